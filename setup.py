@@ -27,5 +27,8 @@ setup(
         'asyncio-nats-client==0.11.2',
         'genson>=1.2.1',
         'psutil>=5.7.0'
-    ]
+    ],
+    extras_require={
+        'fast': ['orjson>=3.0.0'],
+    }
 )
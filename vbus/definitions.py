@@ -4,11 +4,13 @@
     They are not connected to Vbus. They just act as a data holder.
     Each of theses classes can be serialized to Json to be sent on Vbus.
 """
+import sys
+import asyncio
 import inspect
 import genson
 import logging
 from abc import ABC, abstractmethod
-from typing import Callable, Dict, List, Awaitable
+from typing import Callable, Dict, List, Awaitable, Sequence
 from jsonschema import validate as validate_json, ValidationError
 
 LOGGER = logging.getLogger(__name__)
@@ -18,6 +20,23 @@ RawNode = Dict
 SetCallback = Callable[[any, List[str]], Awaitable[any]]
 GetCallback = Callable[[any, List[str]], Awaitable[any]]
 
+# incremented whenever a definition tree changes, cached representations built before are stale
+_tree_version = 0
+# incremented only when elements are added or removed, cached path lookups built before are stale
+_structure_version = 0
+
+
+def _tree_changed(structure: bool = True):
+    global _tree_version, _structure_version
+    _tree_version += 1
+    if structure:
+        _structure_version += 1
+
+
+def structure_version() -> int:
+    """ Returns a number that changes whenever an element is added to or removed from a definition tree. """
+    return _structure_version
+
 
 class Definition(ABC):
     """ Base class for creating an element definition. """
@@ -25,7 +44,7 @@ class Definition(ABC):
     def __init__(self):
         pass
 
-    async def search_path(self, parts: List[str]) -> 'Definition' or None:
+    async def search_path(self, parts: Sequence[str]) -> 'Definition' or None:
         """ Search for a path in this definition.
             It can returns a Definition class or a dictionary or none if not found.
         """
@@ -105,6 +124,7 @@ class MethodDef(Definition):
         self._name = method.__name__
         self._params_schema = params_schema
         self._returns_schema = returns_schema
+        self._spec = None  # lazily inspected (arg names, annotations)
 
         if params_schema is None or returns_schema is None:
             self.validate_callback()
@@ -115,6 +135,16 @@ class MethodDef(Definition):
             if returns_schema is None:
                 self._returns_schema = inspect_returns
 
+        # schemas are static, so the representation is built once
+        self._repr = {
+            "params": {
+                "schema": self._params_schema
+            },
+            "returns": {
+                "schema": self._returns_schema
+            }
+        }
+
     # Convert a Python type to a Json Schema one.
     py_types_to_json_schema = {
         str: "string",
@@ -124,18 +154,33 @@ class MethodDef(Definition):
         None: "null",
     }
 
+    def _inspect_spec(self) -> (List[str], Dict):
+        """ Inspect the callback only once and returns its positional args and annotations. """
+        if self._spec is None:
+            signature = inspect.signature(self._method)
+            args, annotations = [], {}
+            for param in signature.parameters.values():
+                if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD) and param.name != 'self':
+                    args.append(param.name)
+                if param.annotation is not param.empty:
+                    annotations[param.name] = param.annotation
+            if signature.return_annotation is not signature.empty:
+                annotations['return'] = signature.return_annotation
+            self._spec = (args, annotations)
+        return self._spec
+
     def validate_callback(self):
-        inspection = inspect.getfullargspec(self._method)
-        for arg in inspection.args:
-            if arg in ['self', 'kwargs', 'args']:
+        args, annotations = self._inspect_spec()
+        for arg in args:
+            if arg in ['kwargs', 'args']:
                 continue
-            if arg not in inspection.annotations:
+            if arg not in annotations:
                 raise ValueError("you must annotate your callback with type annotation (see "
                                  "https://docs.python.org/3/library/typing.html) or pass schema in constructor.")
-            if inspection.annotations[arg] not in MethodDef.py_types_to_json_schema:
-                raise ValueError(str(inspection.annotations[arg]) + " is not a supported python type.")
+            if annotations[arg] not in MethodDef.py_types_to_json_schema:
+                raise ValueError(str(annotations[arg]) + " is not a supported python type.")
 
-        if 'return' not in inspection.annotations:
+        if 'return' not in annotations:
             raise ValueError("you must annotate return value, even if its None.")
 
     async def handle_set(self, data: any, parts: List[str]):
@@ -145,13 +190,10 @@ class MethodDef(Definition):
             return await self._method(None, parts=parts)
 
     def _inspect_method(self) -> (dict, dict):
-        inspection = inspect.getfullargspec(self._method)
-        ann = inspection.annotations
+        args, ann = self._inspect_spec()
 
         params_schema = {"type": "array", "items": []}
-        for arg in inspection.args:
-            if arg == 'self':
-                continue
+        for arg in args:
             params_schema["items"].append({
                 "type": MethodDef.py_types_to_json_schema[ann[arg]],
                 "title": arg
@@ -161,14 +203,7 @@ class MethodDef(Definition):
         return params_schema, return_schema
 
     async def to_repr(self) -> any:
-        return {
-            "params": {
-                "schema": self._params_schema
-            },
-            "returns": {
-                "schema": self._returns_schema
-            }
-        }
+        return self._repr
 
 
 class AttributeDef(Definition):
@@ -206,6 +241,7 @@ class AttributeDef(Definition):
             except ValidationError as e:
                 raise ValueError('cannot set attribute {}: {}'.format(self._key, str(e)))
         self._value = value
+        _tree_changed(structure=False)
 
     def to_schema(self, value: any) -> any:
         # we use genson library to determine schema type:
@@ -249,13 +285,13 @@ class AttributeDef(Definition):
         else:
             return await self.to_repr()
 
-    async def search_path(self, parts: List[str]) -> 'Definition' or None:
+    async def search_path(self, parts: Sequence[str]) -> 'Definition' or None:
         """ Search for a path in this definition.
             It can returns a Definition class or a dictionary or none if not found.
         """
         if not parts:
             return self
-        elif parts == ['value']:
+        elif len(parts) == 1 and parts[0] == 'value':
             return self
         return None
 
@@ -267,21 +303,32 @@ class NodeDef(Definition):
 
     def __init__(self, node_def: Dict, on_set: SetCallback = None, ):
         super().__init__()
-        self._initialize_structure(node_def)
-        self._structure = node_def
+        self._structure = self._initialize_structure(node_def)
         self._on_set = on_set
+        self._repr = None  # cached representation, valid while _repr_version is the tree version
+        self._repr_version = -1
+        self._dynamic = False  # contains a definition that must be rebuilt on every call (e.g. AsyncNodeDef)
 
-    def _initialize_structure(self, node_def: Dict):
-        """ Take a node definition (raw dict) and replace them with attributes and nodes. """
-        for k, v in node_def.items():
+    @staticmethod
+    def _initialize_structure(node_def: Dict) -> Dict:
+        """ Take a node definition (raw dict) and replace them with attributes and nodes.
+            The dict is converted in place and used as the structure, so it stays shared with the caller.
+            Keys are interned because they are looked up on every incoming path.
+        """
+        items = list(node_def.items())
+        node_def.clear()  # refilled in the same order
+        for k, v in items:
             if isinstance(v, dict):
-                node_def[k] = NodeDef(v)
+                v = NodeDef(v)
             elif not isinstance(v, Definition):
-                node_def[k] = AttributeDef(k, v)
+                v = AttributeDef(k, v)
+            node_def[sys.intern(k) if isinstance(k, str) else k] = v
+        return node_def
 
     def add_child(self, uuid: str, node: 'Definition'):
         """ Add a child element to this definition. """
-        self._structure[uuid] = node
+        self._structure[sys.intern(uuid)] = node
+        _tree_changed()
 
     def remove_child(self, uuid: str) -> 'Definition' or None:
         """ Remove a child element from this definition. """
@@ -290,6 +337,7 @@ class NodeDef(Definition):
 
         builder = self._structure[uuid]
         del self._structure[uuid]
+        _tree_changed()
         return builder
 
     async def handle_set(self, data: any, parts: List[str]):
@@ -298,15 +346,66 @@ class NodeDef(Definition):
         else:
             return None
 
-    async def search_path(self, parts: List[str]) -> Definition or None:
+    async def search_path(self, parts: Sequence[str]) -> Definition or None:
         if not parts:
             return self
         elif parts[0] in self._structure:
             return await self._structure[parts[0]].search_path(parts[1:])
         return None
 
+    def find_static_path(self, parts: Sequence[str]) -> Definition or None:
+        """ Search a path through static definitions only (nodes, attributes and methods).
+            Returns None if not found or if the path goes through a dynamic definition (use search_path then).
+        """
+        definition = self
+        for i, part in enumerate(parts):
+            if type(definition) is NodeDef:
+                definition = definition._structure.get(part)
+            elif type(definition) is AttributeDef and part == 'value' and i == len(parts) - 1:
+                return definition
+            else:
+                return None
+        return definition if type(definition) in (NodeDef, AttributeDef, MethodDef) else None
+
     async def to_repr(self) -> any:
-        return {k: await v.to_repr() for k, v in self._structure.items()}
+        """ The representation is cached while the tree does not change, unless it contains dynamic nodes.
+            It may be shared, callers must not modify it.
+        """
+        if self._repr_version == _tree_version:
+            return self._repr
+
+        version = _tree_version
+        r = await repr_many(self._structure)
+        self._dynamic = any(not self._is_static(v) for v in self._structure.values())
+        if not self._dynamic:
+            self._repr, self._repr_version = r, version
+        return r
+
+    @staticmethod
+    def _is_static(definition: Definition) -> bool:
+        """ Tells if the representation of a definition only changes with the tree version. """
+        if isinstance(definition, NodeDef):
+            return not definition._dynamic
+        return isinstance(definition, (AttributeDef, MethodDef))
+
+
+async def repr_many(defs: Dict[str, Definition]) -> Dict:
+    """ Get the representations of several definitions, keeping the key order.
+        Dynamic definitions (e.g. AsyncNodeDef) may await user callbacks, so they are built concurrently.
+    """
+    r = {}
+    dynamic = []
+    for k, v in defs.items():
+        if NodeDef._is_static(v):
+            r[k] = await v.to_repr()
+        else:
+            r[k] = None  # keep the key order
+            dynamic.append(k)
+
+    if dynamic:
+        for k, v in zip(dynamic, await asyncio.gather(*(defs[k].to_repr() for k in dynamic))):
+            r[k] = v
+    return r
 
 
 AsyncNodeDefCallable = Callable[[], Awaitable[Dict or Definition]]
@@ -327,7 +426,7 @@ class AsyncNodeDef(Definition):
     async def handle_set(self, data: any, parts: List[str]):
         pass  # not implemented for now
 
-    async def search_path(self, parts: List[str]) -> Definition or None:
+    async def search_path(self, parts: Sequence[str]) -> Definition or None:
         node = await self._get_node()
         return await node.search_path(parts)
 
@@ -1,13 +1,21 @@
-import time
+import os
 import json
+import random
 import string
 import socket
-import pydbus
 import logging
+import functools
+import threading
 import collections
+import collections.abc
 from typing import cast, Dict, List, Optional, Tuple
 from socket import inet_ntoa
 
+try:
+    import orjson
+except ImportError:  # optional dependency, fallback to stdlib json
+    orjson = None
+
 LOGGER = logging.getLogger(__name__)
 
 # constants
@@ -18,17 +26,25 @@ NOTIF_VALUE_GET = "value.get"
 NOTIF_SETTED = "set"
 NOTIF_VALUE_SETTED = "value.set"
 
+# pydbus pulls in GObject introspection, so it is only imported on first use
+_pydbus = None
+
 
-def get_hostname() -> Tuple[str, str]:
+def get_hostname() -> Tuple[str, bool]:
     """ Try to retrieve the hostname using Veea dbus api. If it fails, return
         socket.gethostname() value.
     """
+    global _pydbus
+
     hostname = socket.gethostname()
     isvh = False
 
     # try to get hostname if we are on a hub
     try:
-        bus = pydbus.SystemBus()
+        if _pydbus is None:
+            import pydbus
+            _pydbus = pydbus
+        bus = _pydbus.SystemBus()
         hostname = bus.get('io.veea.VeeaHub.Info').Hostname()
         isvh = True
     except Exception:
@@ -37,51 +53,63 @@ def get_hostname() -> Tuple[str, str]:
     return hostname, isvh
 
 
-def from_vbus(data: bytes) -> Dict or None:
-    """ Convert json as bytes to Python object. """
-    if data:
-        return json.loads(data.decode('utf-8'))
-    else:
-        return None
+if orjson:
+    def from_vbus(data: bytes) -> Dict or None:
+        """ Convert json as bytes to Python object. """
+        return orjson.loads(data) if data else None
+
+    def to_vbus(data: any) -> bytes:
+        """ Convert Python object to json as bytes. """
+        if data is None:
+            return b''
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def from_vbus(data: bytes) -> Dict or None:
+        """ Convert json as bytes to Python object. """
+        return json.loads(data) if data else None
+
+    def to_vbus(data: any) -> bytes:
+        """ Convert Python object to json as bytes. """
+        if data is None:
+            return b''
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
 
 
-def to_vbus(data: any) -> bytes:
-    """ Convert Python object to json as bytes. """
-    if data is None:
-        return b''
-    else:
-        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+class EncodedJson(bytes):
+    """ Json already encoded as bytes, a subscription callback can return it to reply it as is. """
 
 
 def prune_dict(tree: dict, max: int, current: int = 0):
-    for key, value in tree.items():
-        if isinstance(value, dict):
-            if current == max:
-                tree[key] = "..."
-            else:
-                prune_dict(value, max, current + 1)
+    """ Replace dictionaries nested deeper than max levels with "..." (in place). """
+    pending = collections.deque([(tree, current)])
+    while pending:
+        node, level = pending.popleft()
+        for key, value in node.items():
+            if isinstance(value, dict):
+                if level == max:
+                    node[key] = "..."
+                else:
+                    pending.append((value, level + 1))
 
 
 def get_path_in_dict(d: Dict, *parts: str):
     """ Find a sub-element in a dict. """
-    root = d
-    for part in parts:
-        if part in root:
-            root = root[part]
-        else:
-            return None  # not found
-    return root
+    try:
+        for part in parts:
+            d = d[part]
+        return d
+    except (KeyError, TypeError):
+        return None  # not found
 
 
 def key_exists(d: Dict, *parts: str) -> bool:
     """ Check whether or not a key exist in the dictionnary"""
-    root = d
-    for part in parts:
-        if part in root:
-            root = root[part]
-        else:
-            return False
-    return True
+    try:
+        for part in parts:
+            d = d[part]
+        return True
+    except (KeyError, TypeError):
+        return False
 
 
 def is_wildcard_path(*parts: str) -> bool:
@@ -94,18 +122,19 @@ def join_path(*args: str) -> str:
 
 
 def is_sequence(obj):
-    if isinstance(obj, str):
+    if isinstance(obj, (list, tuple)):
+        return True
+    if isinstance(obj, (str, bytes, dict)):
         return False
-    return isinstance(obj, collections.Sequence)
+    return isinstance(obj, collections.abc.Sequence)
 
 
-def generate_password(length=22, chars=string.ascii_letters + string.digits):
-    from random import choice
+_system_random = random.SystemRandom()
+
 
-    new_pass = []
-    for i in range(length):
-        new_pass.append(choice(chars))
-    return ''.join(new_pass)
+def generate_password(length=22, chars=string.ascii_letters + string.digits):
+    """ Generate a random password using the OS entropy source. """
+    return ''.join(_system_random.choices(chars, k=length))
 
 
 def zeroconf_search() -> (List[str], Optional[str], Optional[str]):
@@ -114,9 +143,10 @@ def zeroconf_search() -> (List[str], Optional[str], Optional[str]):
     """
     from zeroconf import ServiceBrowser, Zeroconf, ServiceStateChange
 
-    url_found: List[str] = []
+    url_found: Dict[str, None] = {}  # ordered set, the same service can be announced several times
     remote_hostname: Optional[str] = None
     network_ip: Optional[str] = None
+    found = threading.Event()
 
     def on_service_state_change(zeroconf: Zeroconf, service_type, name, state_change: ServiceStateChange) -> None:
         nonlocal url_found, remote_hostname, network_ip
@@ -129,21 +159,50 @@ def zeroconf_search() -> (List[str], Optional[str], Optional[str]):
                 if len(info.addresses) > 0:
                     if b'host' in info.properties and b'hostname' in info.properties:
                         network_ip = info.properties[b'host'].decode()
-                        url_found.append('nats://{}:{}'.format(network_ip, info.port))
+                        url_found[f"nats://{network_ip}:{info.port}"] = None
                         remote_hostname = info.properties[b'hostname'].decode()
-                    url_found.append('nats://{}:{}'.format(inet_ntoa(cast(bytes, info.addresses[0])), info.port))
+                    url_found[f"nats://{inet_ntoa(cast(bytes, info.addresses[0]))}:{info.port}"] = None
                     LOGGER.debug("zeroconf reconstruct: %s", ", ".join(url_found))
+                    found.set()
 
     zc = Zeroconf()
     browser = ServiceBrowser(zc, "_nats._tcp.local.", handlers=[on_service_state_change])
-    time.sleep(5)
+    found.wait(timeout=5)  # stop browsing as soon as vBus answered
     zc.close()
-    return url_found, remote_hostname, network_ip
+    return list(url_found), remote_hostname, network_ip
+
+
+def read_file(path: str) -> bytes:
+    """ Read a whole (small) file with a single read syscall, without python buffered io. """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        while len(data) < size:  # short read, unlikely on regular files
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+    finally:
+        os.close(fd)
+
+
+# characters that are not allowed inside a single nats subject segment
+_NATS_SEGMENT_TRANS = str.maketrans({'.': '_', '*': '_', '>': '_', ' ': '_'})
 
 
 def sanitize_nats_segment(s: str)-> str:
     """ Replace unwanted characters in a nats segment. """
-    return s.replace(".", "_")
+    return s.translate(_NATS_SEGMENT_TRANS)
+
+
+@functools.lru_cache(maxsize=128)
+def _gethostbyname(d: str) -> str:
+    # successful lookups are cached for the process lifetime (DNS TTLs are not honored),
+    # failures raise and are therefore retried on the next call
+    return socket.gethostbyname(d)
+
 
 def get_ip(d: str)-> str:
     """
@@ -151,8 +210,7 @@ def get_ip(d: str)-> str:
     that responds as the given domain name
     """
     try:
-        ip = socket.gethostbyname(d)
-        return ip
-    except Exception:
+        return _gethostbyname(d)
+    except OSError:
         # fail gracefully!
         return ""
\ No newline at end of file
@@ -1,18 +1,21 @@
 import re
 import os
-import json
+import random
 import socket
 import ssl
 import bcrypt
 import logging
 import asyncio
-from typing import Dict, List, Optional, Tuple
+import warnings
+import functools
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from nats.aio.client import Client
-from nats.aio.errors import NatsError
+from nats.aio.errors import NatsError, ErrTimeout
 import importlib.resources as pkg_resources
 from . import certificate  # relative-import the *package* containing the templates
 
-from .helpers import get_hostname, to_vbus, from_vbus, key_exists, sanitize_nats_segment, get_ip
+from .helpers import get_hostname, to_vbus, from_vbus, EncodedJson, key_exists, sanitize_nats_segment, get_ip, read_file
 
 USER_CONFIG = "USER_CONFIG"
 USER_CONFIG_FILE = "/usr/local/config/defaults/user-config.json"
@@ -25,9 +28,40 @@ DEFAULT_PASSWORD= "anonymous"
 
 DEFAULT_TIMEOUT = 0.5
 
+# time budget (in sec) to connect to a candidate vBus url
+PROBE_TIMEOUT = 2.0
+
+# delays (in sec) between connection attempts after registering a new user
+USER_REGISTRATION_RETRY_DELAYS = (0.1, 0.2, 0.4, 0.8)
+
+# upper bound (in sec) of the delay between two permission requests
+PERMISSION_RETRY_MAX_DELAY = 30.0
+
+# messages waiting for a subscription callback, and callbacks running concurrently, per subscription
+# (default of async_subscribe max_workers)
+SUBSCRIPTION_QUEUE_SIZE = 1024
+SUBSCRIPTION_MAX_WORKERS = 16
+
+_CONFIG_FILE_LOCK = threading.Lock()
+
+# The hashed secret is a random 22 chars token (~130 bits of entropy), not a user chosen password,
+# so a high bcrypt cost adds startup latency without making brute force any more realistic.
+BCRYPT_ROUNDS = 8
+
 LOGGER = logging.getLogger(__name__)
 
 
+def _hash_password(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS, prefix=b"2a"))
+
+
+def _encode_reply(value: any) -> bytes:
+    """ Encode a callback return value, pre-encoded json (EncodedJson) is sent as is. """
+    if type(value) is EncodedJson:
+        return value
+    return to_vbus(value)
+
+
 class ExtendedNatsClient:
     def __init__(self, app_domain: str, app_id: str, loop=None, hub_id: str = None, password: str = None):
         """
@@ -47,12 +81,23 @@ class ExtendedNatsClient:
         self._root_folder = self._env[VBUS_PATH]
         if not self._root_folder:
             self._root_folder = self._env['HOME'] + "/vbus/"
+        os.makedirs(self._root_folder, exist_ok=True)
+        self._config_file = os.path.join(self._root_folder, self._id + ".conf")
         self._nats = Client()
         self._network_ip: Optional[str] = None  # populated during mdns discovery
+        self._config: Optional[Dict] = None  # loaded once, then the in-memory version is authoritative
+        self._config_mtime: Optional[int] = None  # config file mtime when self._config was loaded or saved
+        self._anon_nats: Optional[Client] = None  # anonymous connection, used to register the user
+        self._anon_url: Optional[str] = None
+
+        # subject prefixes used by _get_path, id and hostname never change
+        self._id_prefix = f"{self._id}."
+        self._host_prefix = f"{self._hostname}."
+        self._full_prefix = f"{self._id}.{self._hostname}."
 
         self._ssl_ctx = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH)
         ca_path = os.path.join(os.path.dirname(__file__), 'certificate', 'veea-ca.pem')
-        LOGGER.debug("ca file path: " + ca_path)
+        LOGGER.debug("ca file path: %s", ca_path)
         self._ssl_ctx.load_verify_locations(ca_path)
 
         # check which password to use for registration
@@ -62,14 +107,15 @@ class ExtendedNatsClient:
             user_config_file = USER_CONFIG_FILE
             if self._env[USER_CONFIG] is not None:
                 user_config_file = self._env[USER_CONFIG]
-            LOGGER.debug("user-config file path: " + user_config_file)
-            if os.path.isfile(user_config_file):
-                LOGGER.debug("load user configuration file" + user_config_file)
-                with open(user_config_file, 'r') as content_file:
-                    content = content_file.read()
-                    config = json.loads(content)
-                    if config["vBusPwd"] != None:
-                        self._password = config["vBusPwd"] 
+            LOGGER.debug("user-config file path: %s", user_config_file)
+            try:
+                config = from_vbus(read_file(user_config_file))
+            except FileNotFoundError:
+                pass
+            else:
+                LOGGER.debug("load user configuration file %s", user_config_file)
+                if config["vBusPwd"] != None:
+                    self._password = config["vBusPwd"]
             
 
     @property
@@ -85,6 +131,11 @@ class ExtendedNatsClient:
     def nats(self) -> Client:
         return self._nats
 
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """ The event loop the client runs on (bound on connection). """
+        return self._loop
+
     @property
     def network_ip(self) -> Optional[str]:
         """ Return network ip, discovered during Mdns phase. (can be empty)"""
@@ -100,86 +151,108 @@ class ExtendedNatsClient:
         }
 
     async def async_connect(self):
-        config = self.read_or_get_default_config()
-        server_url, new_host = await self._find_vbus_url(config)
+        # bind the loop we are actually running on (in a coroutine, get_event_loop returns the running loop)
+        self._loop = asyncio.get_event_loop()
+        config = await self.async_read_or_get_default_config()
+        try:
+            server_url, new_host = await self._find_vbus_url(config)
 
-        # update the config file with the new url
-        config["vbus"]["url"] = server_url
-        if new_host:
-            self._remote_hostname = sanitize_nats_segment(new_host)
+            # update the config file with the new url
+            config["vbus"]["url"] = server_url
+            if new_host:
+                self._remote_hostname = sanitize_nats_segment(new_host)
 
 
-        # try:
-        #     containerID = int(self._hostname, 16)
-        #     LOGGER.debug("hostname is numerical - change it with remote hostname")
-        #     self._hostname = self._remote_hostname
-        #     config["client"]["user"] = f"{self._id}.{self._hostname}"
-        # except:
-        #     LOGGER.debug("hostname is alphabetical: keep it")
+            # try:
+            #     containerID = int(self._hostname, 16)
+            #     LOGGER.debug("hostname is numerical - change it with remote hostname")
+            #     self._hostname = self._remote_hostname
+            #     config["client"]["user"] = f"{self._id}.{self._hostname}"
+            # except:
+            #     LOGGER.debug("hostname is alphabetical: keep it")
 
-        config["vbus"]["hostname"] = self._remote_hostname
+            config["vbus"]["hostname"] = self._remote_hostname
 
-        if self._network_ip:
-            config["vbus"]["networkIp"] = self._network_ip
+            if self._network_ip:
+                config["vbus"]["networkIp"] = self._network_ip
 
-        self._save_config_file(config)
+            await self._async_save_config_file(config)
 
 
-        # try to connect directly and push user if fail
-        try:
-            await self._nats.connect(server_url, io_loop=self._loop, user=config["client"]["user"],
-                                     password=config["key"]["private"], connect_timeout=1, max_reconnect_attempts=2,
-                                     name=config["client"]["user"], tls=self._ssl_ctx, closed_cb=self._async_nats_closed)
-        except NatsError:
-            LOGGER.debug("unable to connect with user in config file, adding it")
-            await self._publish_user(server_url, config)
-            await asyncio.sleep(1, loop=self._loop)
-            await self._nats.connect(server_url, io_loop=self._loop, user=config["client"]["user"],
-                                     password=config["key"]["private"], connect_timeout=1, max_reconnect_attempts=2,
-                                     name=config["client"]["user"], tls=self._ssl_ctx, closed_cb=self._async_nats_closed)
-
-        await asyncio.sleep(1, loop=self._loop)
+            # try to connect directly and push user if fail
+            try:
+                await self._connect_user(server_url, config)
+            except NatsError:
+                LOGGER.debug("unable to connect with user in config file, adding it")
+                await self._publish_user(server_url, config)
+                # the user is usually registered within tens of ms, so retry with an increasing delay
+                for i, delay in enumerate(USER_REGISTRATION_RETRY_DELAYS):
+                    await asyncio.sleep(delay)
+                    try:
+                        await self._connect_user(server_url, config)
+                        break
+                    except NatsError:
+                        if i == len(USER_REGISTRATION_RETRY_DELAYS) - 1:
+                            raise
+        finally:
+            # the anonymous connection is not needed anymore once we are logged in (or if connecting failed)
+            await self._close_anonymous_client()
+
+        await asyncio.sleep(1)
 
         # we are connected, so we loop until permission are been sent successfully
         path = f"system.authorization.{self._remote_hostname}.{self._id}.{self._hostname}.permissions.set"
+        attempt = 0
         while True:
             try:
                 await self.async_request(path, config["client"]["permissions"], timeout=10, with_id=False,
                                     with_host=False)
                 LOGGER.debug("permission sent")
                 break
-            except:    
-                LOGGER.debug("permission failed to be sent, will retry in 1sec")
-                await asyncio.sleep(1, loop=self._loop)
-                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # capped exponential backoff with full jitter, so clients restarting together do not retry together
+                delay = random.uniform(0, min(PERMISSION_RETRY_MAX_DELAY, 2 ** attempt))
+                attempt = min(attempt + 1, 6)
+                LOGGER.debug("permission failed to be sent, will retry in %.2fsec", delay)
+                await asyncio.sleep(delay)
         
         
 
         LOGGER.debug("connected")
 
     async def ask_permission(self, permission) -> bool:
-        config = self.read_or_get_default_config()
-        file_changed = False
+        config = await self.async_read_or_get_default_config()
+
+        changed_lists = []
 
         subscribe = config["client"]["permissions"]["subscribe"]
         if permission not in subscribe:
             subscribe.append(permission)
-            file_changed = True
+            changed_lists.append(subscribe)
 
         publish = config["client"]["permissions"]["publish"]
         if permission not in publish:
             publish.append(permission)
-            file_changed = True
+            changed_lists.append(publish)
 
-        if file_changed:
+        if changed_lists:
             LOGGER.debug("permissions changed, sending them to server")
             path = f"system.authorization.{self._remote_hostname}.{self._id}.{self._hostname}.permissions.set"
-            resp = await self.async_request(path, config["client"]["permissions"], timeout=10, with_id=False,
-                                            with_host=False)
+            resp = None
+            try:
+                resp = await self.async_request(path, config["client"]["permissions"], timeout=10, with_id=False,
+                                                with_host=False)
+            finally:
+                if resp:
+                    await self._async_save_config_file(config)
+                else:
+                    # keep the in-memory configuration in sync with the file
+                    for permissions in changed_lists:
+                        permissions.remove(permission)
 
-            if resp:
-                self._save_config_file(config)
-            else:
+            if not resp:
                 LOGGER.warning("cannot send permission to server")
 
             return resp
@@ -187,18 +260,40 @@ class ExtendedNatsClient:
         LOGGER.debug("permissions are already ok")
         return True
 
+    async def _connect_user(self, server_url: str, config):
+        # a rejected login must fail at once, otherwise the nats client waits reconnect_time_wait (2 sec) between
+        # its own attempts and hides the USER_REGISTRATION_RETRY_DELAYS schedule
+        await self._nats.connect(server_url, user=config["client"]["user"],
+                                 password=config["key"]["private"], connect_timeout=1, max_reconnect_attempts=2,
+                                 allow_reconnect=False, name=config["client"]["user"], tls=self._ssl_ctx,
+                                 closed_cb=self._async_nats_closed)
+        # once logged in, reconnect if the connection is lost (the option is read when the connection drops)
+        self._nats.options["allow_reconnect"] = True
+
     async def _async_nats_closed(self):
+        await self._close_anonymous_client()
         await self._nats.close()
 
+    async def _get_anonymous_client(self, server_url: str) -> Client:
+        """ Returns a connected anonymous client, the connection is reused while it's open. """
+        if self._anon_nats is None or self._anon_url != server_url or not self._anon_nats.is_connected:
+            await self._close_anonymous_client()
+            nats = Client()
+            await nats.connect(server_url,
+                               user="anonymous", password=self._password, tls=self._ssl_ctx,
+                               connect_timeout=1, max_reconnect_attempts=2)
+            self._anon_nats, self._anon_url = nats, server_url
+        return self._anon_nats
+
+    async def _close_anonymous_client(self):
+        nats, self._anon_nats, self._anon_url = self._anon_nats, None, None
+        if nats is not None and not nats.is_closed:  # also when it's reconnecting
+            await nats.close()
+
     async def _publish_user(self, server_url: str, config):
-        nats = Client()
-        await nats.connect(server_url, loop=self._loop,
-                           user="anonymous", password=self._password, tls=self._ssl_ctx,
-                           connect_timeout=1, max_reconnect_attempts=2)
-        data = json.dumps(config["client"]).encode('utf-8')
-        await nats.publish("system.authorization." + self._remote_hostname + ".add", data)
+        nats = await self._get_anonymous_client(server_url)
+        await nats.publish("system.authorization." + self._remote_hostname + ".add", to_vbus(config["client"]))
         await nats.flush()
-        await nats.close()
 
     async def _find_vbus_url(self, config) -> (str, Optional[str]):
         """
@@ -208,14 +303,18 @@ class ExtendedNatsClient:
         """
 
         # find Vbus server - strategy 0: get from argument
-        def get_from_hub_id() -> Tuple[List[str], Optional[str]]:
+        async def get_from_hub_id() -> Tuple[List[str], Optional[str]]:
             ip = self._remote_hostname
             try:
                 socket.inet_aton(self._remote_hostname)
-            except:
+            except OSError:
                 try:
-                    ip = socket.gethostbyname(f"{self._remote_hostname}.local")
-                except:
+                    # resolve without blocking the event loop
+                    infos = await asyncio.wait_for(
+                        self._loop.getaddrinfo(f"{self._remote_hostname}.local", None, family=socket.AF_INET),
+                        timeout=1.0)
+                    ip = infos[0][4][0]
+                except (OSError, IndexError, asyncio.TimeoutError):
                     return [], None  # cannot resolve
             return [f"tls://{ip}:21400"], None
 
@@ -226,17 +325,18 @@ class ExtendedNatsClient:
 
         # find vbus server  - strategy 2: get url from ENV:VBUS_URL
         def get_from_env() -> Tuple[List[str], Optional[str]]:
-            return [os.environ.get("VBUS_URL")], None
+            return [self._env[VBUS_URL]], None
 
         # find vbus server  - strategy 3: try default url client://hostname.service.veeamesh.local:21400
         def get_local_default() -> Tuple[List[str], Optional[str]]:
             return [f"tls://"+self._hostname+".service.veeamesh.local:21400"], None
 
         # find vbus server  - strategy 4: find it using avahi
-        def get_from_zeroconf() -> Tuple[List[str], Optional[str]]:
+        async def get_from_zeroconf() -> Tuple[List[str], Optional[str]]:
             if self._isvh == False:
                 from .helpers import zeroconf_search
-                urls, host, network_ip = zeroconf_search()
+                # mdns browsing is blocking, run it in a thread
+                urls, host, network_ip = await self._loop.run_in_executor(None, zeroconf_search)
                 self._network_ip = network_ip
                 return urls, host
             else:
@@ -259,75 +359,129 @@ class ExtendedNatsClient:
             get_global_default,
         ]
 
-        success_url = None
-        new_host = None
+        async def run_strategy(strategy) -> Tuple[List[str], Optional[str]]:
+            result = strategy()
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
 
-        for strategy in find_server_url_strategies:
-            if success_url:
-                break
+        # a virtual hub asks the vBus hostname during the probe, the dns name is resolved once for all probes
+        server_ip = None if self._isvh else self._loop.run_in_executor(None, get_ip, VBUS_DNS)
 
-            server_urls, new_host = strategy()
-            for url in server_urls:
-                if await self._test_vbus_url(url):
-                    LOGGER.debug("url found using strategy '%s': %s", strategy.__name__, url)
-                    success_url = url
-                    if self._isvh == False:
-                        newHost = await self._get_hostname_from_vBus(url)
-                        if newHost != "":
-                            new_host = newHost
-                    break
-                else:
-                    LOGGER.debug("cannot find a valid url using strategy '%s': %s", strategy.__name__, url)
+        # an explicit url bypasses discovery, other strategies are only tried if it's not reachable
+        success_url, new_host = None, None
+        env_url = self._env[VBUS_URL]
+        if env_url:
+            success_url, new_host = await self._probe_candidates({env_url: (0, get_from_env, None)}, server_ip)
+
+        if not success_url:
+            # collect candidate urls from all strategies concurrently, then probe them all at once
+            results = await asyncio.gather(*(run_strategy(s) for s in find_server_url_strategies))
+            candidates: Dict[str, Tuple[int, Callable, Optional[str]]] = {}  # url -> (priority, strategy, hostname)
+            for priority, (strategy, (server_urls, host)) in enumerate(zip(find_server_url_strategies, results)):
+                for url in server_urls:
+                    # several strategies can return the same url, and the env url was already tried
+                    if url and url != env_url and url not in candidates:
+                        candidates[url] = (priority, strategy, host)
+            success_url, new_host = await self._probe_candidates(candidates, server_ip)
 
         if not success_url:
             raise ConnectionError("cannot find a valid Vbus url")
         else:
             return success_url, new_host
 
-    async def _test_vbus_url(self, url: str, user="anonymous") -> bool:
+    async def _probe_candidates(self, candidates: Dict[str, Tuple[int, Callable, Optional[str]]],
+                                server_ip: Optional[Awaitable[str]]) -> Tuple[Optional[str], Optional[str]]:
+        """ Probes all candidate urls at once.
+            :param candidates: url -> (priority, strategy, hostname)
+            :return: The first reachable url (None if none) and the new remote hostname
+        """
+        success_url = None
+        new_host = None
+        probes = {asyncio.ensure_future(self._probe_vbus_url(url, server_ip)): url for url in candidates}
+        pending = set(probes)
+        try:
+            while pending and not success_url:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # if several probes succeed at once, prefer the url of the first strategy
+                for probe in sorted(done, key=lambda p: candidates[probes[p]][0]):
+                    url = probes[probe]
+                    _, strategy, host = candidates[url]
+                    nc, vbus_hostname = probe.result()
+                    if nc is None:
+                        LOGGER.debug("cannot find a valid url using strategy '%s': %s", strategy.__name__, url)
+                    elif success_url:
+                        await nc.close()  # another url already won
+                    else:
+                        LOGGER.debug("url found using strategy '%s': %s", strategy.__name__, url)
+                        success_url, new_host = url, vbus_hostname or host
+                        # keep the probe connection, it is reused to query the hostname and register the user
+                        await self._close_anonymous_client()
+                        self._anon_nats, self._anon_url = nc, url
+        finally:
+            # the first reachable url wins, cancel the remaining probes
+            for probe in pending:
+                if not probe.done():
+                    probe.cancel()
+                elif not probe.cancelled() and probe.exception() is None:
+                    # finished while we were busy (e.g. closing another connection), it's not cancellable anymore
+                    nc, _ = probe.result()
+                    if nc is not None:
+                        await nc.close()
+
+        return success_url, new_host
+
+    async def _test_vbus_url(self, url: str, user="anonymous") -> Optional[Client]:
+        """ Returns a client connected to url, or None if it's not reachable. """
         if not url:
-            return False
+            return None
 
         nc = Client()
-        LOGGER.debug("test connection to: " + url + " with user: " + user)
+        LOGGER.debug("test connection to: %s with user: %s", url, user)
+        connected = False
         try:
-            task = nc.connect(url, loop=self._loop, user=user, password=self._password, connect_timeout=1,
-                              max_reconnect_attempts=2, tls=self._ssl_ctx)
-
-            # Wait for at most 5 seconds, in some case nats library is stuck...
-            await asyncio.wait_for(task, timeout=5)
+            # a single attempt within one time budget, wait_for also covers the cases where the nats library is stuck
+            await asyncio.wait_for(nc.connect(url, user=user, password=self._password, connect_timeout=PROBE_TIMEOUT,
+                                              max_reconnect_attempts=0, tls=self._ssl_ctx),
+                                   timeout=PROBE_TIMEOUT)
+            connected = True
+            return nc
+        except asyncio.CancelledError:
+            raise
         except Exception:
-            return False
-        else:
-            return True
-
-    async def _get_hostname_from_vBus(self, url: str, user="anonymous") -> str:
-        if not url:
-            return ""
-
-        serverIP = get_ip(VBUS_DNS)
+            return None
+        finally:
+            # release the socket unless the connection is handed to the caller,
+            # also when the handshake was interrupted by the timeout or a cancellation
+            if not connected and not nc.is_closed:
+                await nc.close()
+
+    async def _probe_vbus_url(self, url: str, server_ip: Optional[Awaitable[str]]) -> Tuple[Optional[Client], str]:
+        """ Tests url and, when server_ip is given, asks the vBus hostname on the same connection.
+            :return: the connected client (None if url is not reachable) and the vBus hostname ("" if unknown)
+        """
+        nc = await self._test_vbus_url(url)
+        if nc is None or server_ip is None:
+            return nc, ""
+        try:
+            return nc, await self._get_hostname_from_vBus(nc, await server_ip)
+        except asyncio.CancelledError:
+            await nc.close()
+            raise
 
-        vbus_hostname = ""
-        nc = Client()
+    @staticmethod
+    async def _get_hostname_from_vBus(nc: Client, server_ip: str) -> str:
         try:
-            task = nc.connect(url, loop=self._loop, user=user, password=self._password, connect_timeout=1,
-                              max_reconnect_attempts=2, tls=self._ssl_ctx)
-
-            # Wait for at most 5 seconds, in some case nats library is stuck...
-            await asyncio.wait_for(task, timeout=5)
-
-            try:                           
-                msg = await nc.request(PATH_TO_INFO, serverIP.encode('utf-8'), timeout=10)
-                data = msg.data.decode()
-                LOGGER.debug(data)                          
-                vbus_info = json.loads(data)
-                vbus_hostname = vbus_info["hostname"]                      
-            except ErrTimeout:
-                print("Request vbus.info timed out")
+            msg = await nc.request(PATH_TO_INFO, server_ip.encode('utf-8'), timeout=10)
+            LOGGER.debug("vbus info: %s", msg.data)
+            return from_vbus(msg.data)["hostname"]
+        except ErrTimeout:
+            LOGGER.warning("request %s timed out", PATH_TO_INFO)
+        except asyncio.CancelledError:
+            raise
         except Exception:
-            return ""
-        else:
-            return vbus_hostname
+            LOGGER.debug("cannot get the vbus hostname", exc_info=True)
+        return ""
 
     @staticmethod
     def _validate_configuration(c: Dict):
@@ -343,40 +497,87 @@ class ExtendedNatsClient:
     def _check_config_hostname(self, c: Dict):
         _extracted_conf_name = c["client"]["user"].split('.')[2]
         if _extracted_conf_name != self._hostname:
-            LOGGER.debug("Replace user: " + c["client"]["user"])
+            LOGGER.debug("Replace user: %s", c["client"]["user"])
             c["client"]["user"] = c["client"]["user"].replace(_extracted_conf_name, self._hostname)
-            LOGGER.debug("with: " + c["client"]["user"])
+            LOGGER.debug("with: %s", c["client"]["user"])
+
+    async def async_read_or_get_default_config(self) -> Dict:
+        """ Returns the client configuration.
+            It is read (or created) once and re-read only when the file changes on disk,
+            callers update it in place then save it with _async_save_config_file.
+        """
+        mtime = self._get_config_file_mtime()
+        if self._config is None or mtime != self._config_mtime:  # not loaded yet or edited by someone else
+            self._config = await self._async_load_config()
+            self._config_mtime = mtime
+        return self._config
+
+    def _get_config_file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self._config_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
 
     def read_or_get_default_config(self) -> Dict:
+        """ Returns the client configuration, blocking version of async_read_or_get_default_config.
 
-        if not os.access(self._root_folder, os.F_OK):
-            os.mkdir(self._root_folder)
-
-        LOGGER.debug("check if we already have a Vbus config file in " + self._root_folder)
-        config_file = os.path.join(self._root_folder, self._id + ".conf")
-        if os.path.isfile(config_file):
-            LOGGER.debug("load existing configuration file for " + self._id)
-            with open(config_file, 'r') as content_file:
-                content = content_file.read()
-                config = json.loads(content)
-                if self._validate_configuration(config):
-                    self._check_config_hostname(config)
-                    return config
-                else:
-                    LOGGER.warning('invalid configuration detected, the file will be reset to the default one (%s)',
-                                   config)
-                    return self._create_default_config()
+            Deprecated: use `await client.async_read_or_get_default_config()`, this one reads the file
+            (and hashes a new credential) on the calling thread.
+        """
+        warnings.warn("read_or_get_default_config() is deprecated, use async_read_or_get_default_config()",
+                      DeprecationWarning, stacklevel=2)
+        mtime = self._get_config_file_mtime()
+        if self._config is None or mtime != self._config_mtime:
+            try:
+                config = self._parse_config(read_file(self._config_file))
+            except FileNotFoundError:
+                config = None
+            if config is None:
+                password = self._generate_password()
+                config = self._default_config(password, _hash_password(password))
+            self._config, self._config_mtime = config, mtime
+        return self._config
+
+    async def _async_load_config(self) -> Dict:
+        LOGGER.debug("check if we already have a Vbus config file in %s", self._root_folder)
+        try:
+            content = await self._loop.run_in_executor(None, read_file, self._config_file)
+        except FileNotFoundError:
+            return await self._async_create_default_config()
+
+        config = self._parse_config(content)
+        if config is None:
+            return await self._async_create_default_config()
+        return config
+
+    def _parse_config(self, content: bytes) -> Optional[Dict]:
+        """ Returns the configuration stored in the file content, or None if it's not valid. """
+        LOGGER.debug("load existing configuration file for %s", self._id)
+        config = from_vbus(content)
+        if self._validate_configuration(config):
+            self._check_config_hostname(config)
+            return config
         else:
-            return self._create_default_config()
+            # do not dump the configuration, it contains the private key
+            LOGGER.warning('invalid configuration detected, the file will be reset to the default one (%s)',
+                           self._config_file)
+            return None
 
-    def _create_default_config(self):
+    async def _async_create_default_config(self):
         """ Creates the default configuration. """
+        password = self._generate_password()
+        # hashing is cpu bound, run it in a thread to keep the event loop responsive
+        public_key = await self._loop.run_in_executor(None, _hash_password, password)
+        return self._default_config(password, public_key)
+
+    def _generate_password(self) -> str:
         from .helpers import generate_password
 
-        LOGGER.debug("create new configuration file for " + self._id)
+        LOGGER.debug("create new configuration file for %s", self._id)
+        return generate_password()
+
+    def _default_config(self, password: str, public_key: bytes) -> Dict:
         # TODO: this template should be in a git repo shared between all vbus impl
-        password = generate_password()
-        public_key = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=11, prefix=b"2a"))
         return {
             "client": {
                 "user"       : f"{self._id}.{self._hostname}",
@@ -402,13 +603,27 @@ class ExtendedNatsClient:
             }
         }
 
-    def _save_config_file(self, config):
-        config_file = os.path.join(self._root_folder, self._id + ".conf")
-        LOGGER.debug("saving configuration file: " + config_file)
-        with open(config_file, 'w+') as f:
-            json.dump(config, f)
-
-    async def async_subscribe(self, path, cb, with_id: bool = True, with_host: bool = True) -> int:
+    async def _async_save_config_file(self, config):
+        """ Saves the configuration, the file is written in a thread to keep the event loop responsive. """
+        self._config = config
+        content = to_vbus(config)  # serialize now, the config may be updated while the file is written
+        await self._loop.run_in_executor(None, self._write_config_file, content)
+        self._config_mtime = self._get_config_file_mtime()
+
+    def _write_config_file(self, content: bytes):
+        config_file = self._config_file
+        LOGGER.debug("saving configuration file: %s", config_file)
+        # write to a temporary file then rename it, so a crash never leaves a truncated config
+        tmp_file = config_file + ".tmp"
+        with _CONFIG_FILE_LOCK:  # concurrent saves share the temporary file
+            with open(tmp_file, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, config_file)
+
+    async def async_subscribe(self, path, cb, with_id: bool = True, with_host: bool = True,
+                              max_workers: Optional[int] = SUBSCRIPTION_MAX_WORKERS) -> int:
         """ Utility method that automatically parse subject wildcard to arguments and
             if a value is returned, publish this value on the reply subject.
 
@@ -416,6 +631,8 @@ class ExtendedNatsClient:
             :param cb: The handler
             :param with_id: Prepend the app id without host
             :param with_host: Prepend full root app_id + host
+            :param max_workers: Maximum number of callbacks running concurrently, None for no limit
+                                (use it when a slow callback must not delay the other messages)
             :return: nats sid
 
             :example:
@@ -426,32 +643,82 @@ class ExtendedNatsClient:
             await async_subscribe("zigbee", "endpoints", "*", "clusters", "*", cb=handler)
         """
         path = self._get_path(path, with_id, with_host)
-        # create a regex that capture wildcard and chevron
-        regex = path.replace(".", r"\.").replace("*", r"([^.]+)").replace(">", r"(.+)")
+        pattern = self._compile_subject_pattern(path)
+
+        if max_workers is None:
+            async def on_data_unbounded(msg):
+                # one task per message, we don't want to await here because it will block everything
+                self._loop.create_task(self._subscribe_on_data_task(cb, pattern, msg))
+
+            return await self.nats.subscribe(path, cb=on_data_unbounded)
+
+        queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        workers = 0
+
+        async def worker():
+            nonlocal workers
+            try:
+                while not queue.empty():
+                    await self._subscribe_on_data_task(cb, pattern, queue.get_nowait())
+            finally:
+                workers -= 1
 
         async def on_data(msg):
-            # start a task
-            # we don't want to await here because it will block everything while computing the callback.
-            asyncio.get_event_loop().create_task(self._subscribe_on_data_task(cb, regex, msg))
+            nonlocal workers
+            # we don't want to await the callback here because it will block everything while computing it.
+            # messages are handed to a few workers (started on demand, they stop when idle), when the queue
+            # is full we wait, which pushes back on the nats subscription.
+            await queue.put(msg)
+            if workers < max_workers:
+                workers += 1
+                self._loop.create_task(worker())
 
         return await self.nats.subscribe(path, cb=on_data)
 
-    async def _subscribe_on_data_task(self, cb, regex, msg):
-        m = re.match(regex, msg.subject)
-        if m:
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _compile_subject_pattern(path: str) -> Optional[Tuple[Tuple[int, ...], Optional[int]]]:
+        """ Find the segments to capture: the indexes of the wildcards and the index of the chevron (or None).
+            Returns None for a static subject: nats only delivers this exact subject, there is nothing to capture.
+        """
+        if '*' not in path and '>' not in path:
+            return None
+        segments = path.split('.')
+        wildcards = tuple(i for i, segment in enumerate(segments) if segment == '*')
+        chevron = len(segments) - 1 if segments[-1] == '>' else None
+        return wildcards, chevron
+
+    async def _subscribe_on_data_task(self, cb, pattern, msg):
+        if pattern is None:
+            groups = ()
+        else:
+            # nats only delivers subjects matching the subscription, literal segments do not need to be checked
+            wildcards, chevron = pattern
+            segments = msg.subject.split('.')
             try:
-                ret = await cb(from_vbus(msg.data), *m.groups())
-                if msg.reply:
-                    await self._nats.publish(msg.reply, to_vbus(ret))
-            except Exception as e:
-                LOGGER.exception(e)
+                groups = [segments[i] for i in wildcards]
+            except IndexError:
+                return
+            if chevron is not None:
+                if len(segments) <= chevron:
+                    return
+                groups.append('.'.join(segments[chevron:]))
+
+        try:
+            ret = await cb(from_vbus(msg.data), *groups)
+            if msg.reply:
+                await self._nats.publish(msg.reply, _encode_reply(ret))
+        except Exception:
+            LOGGER.exception("subscription callback failed for subject %s", msg.subject)
 
     def _get_path(self, path: str, with_id: bool, with_host: bool):
-        if with_host:
-            path = '.'.join(filter(None, [self.hostname, path]))
         if with_id:
-            path = '.'.join(filter(None, [self.id, path]))
-        return path
+            prefix = self._full_prefix if with_host else self._id_prefix
+        elif with_host:
+            prefix = self._host_prefix
+        else:
+            return path
+        return prefix + path if path else prefix[:-1]
 
     async def async_request(self, path: str, data: any, timeout: float = DEFAULT_TIMEOUT, with_id: bool = True,
                             with_host: bool = True) -> any:
@@ -459,7 +726,13 @@ class ExtendedNatsClient:
         msg = await self._nats.request(path, to_vbus(data), timeout=timeout)
         return from_vbus(msg.data)
 
-    async def async_publish(self, path: str, data: any, with_id: bool = True, with_host: bool = True):
+    async def async_publish(self, path: str, data: any, with_id: bool = True, with_host: bool = True,
+                            flush: bool = False):
+        """ Publish data on a path.
+            The nats client writes pending messages in background, set flush to wait for the server
+            acknowledgement (one round-trip).
+        """
         path = self._get_path(path, with_id, with_host)
         await self._nats.publish(path, to_vbus(data))
-        await self._nats.flush()
+        if flush:
+            await self._nats.flush()
@@ -5,22 +5,95 @@
 """
 import abc
 import os
+import stat
+import copy
 import sys
+import time
 import socket
+from uuid import uuid4
 import base64
+import functools
 import asyncio
 import logging
-from typing import Dict, Callable, Awaitable, List, Optional, Union
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Callable, Awaitable, List, Optional, Sequence, Union
 
 from vbus.definitions import Definition
 from . import definitions
-from . import proxies
-from .helpers import from_vbus, join_path, to_vbus, prune_dict, NOTIF_ADDED, NOTIF_REMOVED, NOTIF_VALUE_SETTED, \
-    NOTIF_SETTED, NOTIF_GET
+from .helpers import from_vbus, join_path, to_vbus, EncodedJson, prune_dict, read_file, NOTIF_ADDED, NOTIF_REMOVED, \
+    NOTIF_VALUE_SETTED, NOTIF_SETTED, NOTIF_GET
 from .nats import ExtendedNatsClient, DEFAULT_TIMEOUT
 
+if TYPE_CHECKING:
+    from . import proxies  # imported on first use, many apps never access remote elements
+
+try:
+    from psutil import Process as _PsProcess
+except ImportError:  # the heap size is reported as 0
+    _PsProcess = None
+
 LOGGER = logging.getLogger(__name__)
 
+# remote method definitions are reused for this many seconds by get_remote_method
+REMOTE_METHOD_CACHE_TTL = 30
+REMOTE_METHOD_CACHE_SIZE = 256
+# pruned tree responses are cached by _on_get_nodes for at most this many max_level values
+PRUNED_RESPONSES_MAX_LEVELS = 8
+
+
+@functools.lru_cache(maxsize=32)
+def _encode_static_file(path: str, mtime_ns: int) -> str:
+    """ Read a file and encode it in base64 (kept as an ascii str, it's sent inside json). """
+    return base64.b64encode(read_file(path)).decode('ascii')
+
+
+class _PendingUpdates:
+    """ Added notifications buffered while NodeManager.batch_updates() is active, merged by subject. """
+    __slots__ = ('_client', '_depth', 'added')
+
+    def __init__(self, client: ExtendedNatsClient):
+        self._client = client
+        self._depth = 0  # nested batch_updates() count
+        self.added: Dict[str, Dict] = {}  # subject -> merged packet
+
+    @property
+    def active(self) -> bool:
+        return self._depth > 0
+
+    async def flush(self, subject: str):
+        """ Publish the packet buffered for this subject now. """
+        packet = self.added.pop(subject, None)
+        if packet is not None:
+            await self._client.async_publish(subject, packet)
+
+    async def flush_under(self, path: str):
+        """ Publish the packets buffered for the descendants of this path now. """
+        prefix = path + '.'
+        for subject in [s for s in self.added if s.startswith(prefix)]:
+            await self.flush(subject)
+
+    async def flush_covering(self, path: str):
+        """ Publish the packets buffered for the addition of this path (or of one of its ancestors) now. """
+        for subject in list(self.added):
+            parent = subject[:-len(NOTIF_ADDED)].rstrip('.')  # the subject is join_path(parent path, NOTIF_ADDED)
+            if parent and not path.startswith(parent + '.'):
+                continue
+            child = path[len(parent) + 1:] if parent else path
+            if child.split('.', 1)[0] in self.added[subject]:
+                await self.flush(subject)
+
+    async def __aenter__(self):
+        self._depth += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            # elements are in the local tree even if the block failed, so always notify
+            added, self.added = self.added, {}
+            for subject, packet in added.items():
+                await self._client.async_publish(subject, packet)
+
 
 class Element(abc.ABC):
     """ Base class for all Vbus connected elements. """
@@ -31,6 +104,10 @@ class Element(abc.ABC):
         self._definition = definition
         self._parent = parent
         self._urisNode: Optional[Node] = None
+        # the parent and uuid never change, so the full path is computed once
+        self._path = join_path(parent.path, uuid) if parent else uuid
+        # shared by the whole tree, see NodeManager.batch_updates()
+        self._pending = parent._pending if parent is not None else _PendingUpdates(client)
 
     @property
     def uuid(self) -> str:
@@ -42,11 +119,8 @@ class Element(abc.ABC):
 
     @property
     def path(self) -> str:
-        """ Returns the full path recursively. """
-        if self._parent:
-            return join_path(self._parent.path, self._uuid)
-        else:
-            return self._uuid
+        """ Returns the full path. """
+        return self._path
 
 
 class Node(Element):
@@ -57,6 +131,9 @@ class Node(Element):
     def __init__(self, client: ExtendedNatsClient, uuid: str, definition: definitions.NodeDef, parent: Element = None):
         super().__init__(client, uuid, definition, parent)
         self._definition = definition
+        # notification subjects are static, build them once
+        self._added_subject = sys.intern(join_path(self._path, NOTIF_ADDED))
+        self._removed_subject = sys.intern(join_path(self._path, NOTIF_REMOVED))
 
     async def add_node(self, uuid: str, raw_node: definitions.RawNode, on_set: Callable = None) -> 'Node':
         """ Add a new raw node in this tree.
@@ -78,13 +155,7 @@ class Node(Element):
             :param on_set: A callback called when setted
         """
         definition = definitions.NodeDef(raw_node, on_set=on_set)  # create the definition
-        node = Node(self._client, uuid, definition, self)  # create the connected node
-        self._definition.add_child(uuid, definition)  # add it
-
-        # send the node definition on Vbus
-        packet = {uuid: await definition.to_repr()}
-        await self._client.async_publish(join_path(self.path, NOTIF_ADDED), packet)
-        return node
+        return (await self._add_definitions({uuid: definition}))[uuid]
 
     async def add_node_def(self, uuid: str, node_def: Union[definitions.NodeDef, definitions.AsyncNodeDef],
                            on_set: Callable = None) -> 'Node':
@@ -96,13 +167,7 @@ class Node(Element):
             :param node_def: Node definition
             :param on_set: A callback called when setted
         """
-        node = Node(self._client, uuid, node_def, self)  # create the connected node
-        self._definition.add_child(uuid, node_def)  # add it
-
-        # send the node definition on Vbus
-        packet = {uuid: await node_def.to_repr()}
-        await self._client.async_publish(join_path(self.path, NOTIF_ADDED), packet)
-        return node
+        return (await self._add_definitions({uuid: node_def}))[uuid]
 
     async def add_attribute(self, uuid: str, value: any = None, on_set: definitions.SetCallback = None,
                             on_get: definitions.GetCallback = None) -> 'Attribute':
@@ -116,13 +181,7 @@ class Node(Element):
             :param on_get: callback on get
         """
         definition = definitions.AttributeDef(uuid, value, on_set=on_set, on_get=on_get)  # create the definition
-        node = Attribute(self._client, uuid, definition, self)  # create the connected node
-        self._definition.add_child(uuid, definition)  # add it
-
-        # send the node definition on Vbus
-        packet = {uuid: await definition.to_repr()}
-        await self._client.async_publish(join_path(self.path, NOTIF_ADDED), packet)
-        return node
+        return (await self._add_definitions({uuid: definition}))[uuid]
 
     async def add_method(self, uuid: str, method: Callable) -> 'Method':
         """ Add a new method in this tree.
@@ -137,43 +196,75 @@ class Node(Element):
             :param method: Method callable
         """
         definition = definitions.MethodDef(method)  # create the definition
-        node = Method(self._client, uuid, definition, self)  # create the connected node
-        self._definition.add_child(uuid, definition)  # add it
+        return (await self._add_definitions({uuid: definition}))[uuid]
+
+    async def add_children(self, children: Dict[str, Union[definitions.RawNode, Definition, any]],
+                           on_set: Callable = None) -> Dict[str, Element]:
+        """ Add several elements in this tree, they are sent on Vbus in a single message.
+
+            >>> elements = await client.add_children({
+            >>>     "00:45:25:65:25:ff": {'name': definitions.A("name", None)},  # a raw node
+            >>>     "scan": definitions.MethodDef(on_scan),                      # a method
+            >>>     "name": "Phillips",                                          # an attribute
+            >>> })
 
-        # send the node definition on Vbus
-        packet = {uuid: await definition.to_repr()}
-        await self._client.async_publish(join_path(self.path, NOTIF_ADDED), packet)
-        return node
+            :param children: Uuid to raw node, definition or attribute value
+            :param on_set: A callback called when a raw node is setted
+            :return: Uuid to connected element
+        """
+        defs = {}
+        for uuid, child in children.items():
+            if isinstance(child, Definition):
+                defs[uuid] = child
+            elif isinstance(child, dict):
+                defs[uuid] = definitions.NodeDef(child, on_set=on_set)
+            else:
+                defs[uuid] = definitions.AttributeDef(uuid, child)
+        return await self._add_definitions(defs)
+
+    async def _add_definitions(self, defs: Dict[str, Definition]) -> Dict[str, Element]:
+        """ Add definitions in this tree and send them on Vbus in one packet. """
+        elements = {}
+        for uuid, definition in defs.items():
+            elements[uuid] = self._create_element(uuid, definition)  # create the connected node
+            self._definition.add_child(uuid, definition)  # add it
+
+        # send the definitions on Vbus
+        packet = await definitions.repr_many(defs)
+        if self._pending.active:
+            self._pending.added.setdefault(self._added_subject, {}).update(packet)
+        else:
+            await self._client.async_publish(self._added_subject, packet)
+        return elements
+
+    def _create_element(self, uuid: str, definition: Definition) -> Element:
+        """ Create the connected element matching a definition. """
+        if isinstance(definition, definitions.AttributeDef):
+            return Attribute(self._client, uuid, definition, self)
+        elif isinstance(definition, definitions.MethodDef):
+            return Method(self._client, uuid, definition, self)
+        return Node(self._client, uuid, definition, self)
 
     async def get_attribute(self, *parts: str) -> Optional['Attribute']:
         """ Retrieve a local attribute.
 
             :return: None if not found in local tree
          """
-        definition = await self._definition.search_path(list(parts))
-        if not definition:
-            return None
-
-        # test that the definition is an attribute def
-        if isinstance(definition, definitions.AttributeDef):
-            return Attribute(self._client, join_path(*parts), definition, self)
-        else:
-            return None
+        return await self._local_element(parts, definitions.AttributeDef, Attribute)
 
     async def get_method(self, *parts: str) -> Optional['Method']:
         """ Retrieve a local method.
 
             :return: None if not found in local tree
          """
-        definition = await self._definition.search_path(list(parts))
-        if not definition:
-            return None
+        return await self._local_element(parts, definitions.MethodDef, Method)
 
-        # test that the definition is a method def
-        if isinstance(definition, definitions.MethodDef):
-            return Method(self._client, join_path(*parts), definition, self)
-        else:
-            return None
+    async def _local_element(self, parts: Sequence[str], definition_cls: type, element_cls: type) -> Optional[Element]:
+        """ Search a local definition and wrap it in a connected element if it has the expected type. """
+        definition = await self._definition.search_path(parts)
+        if isinstance(definition, definition_cls):
+            return element_cls(self._client, join_path(*parts), definition, self)
+        return None
 
     async def remove_element(self, uuid: str) -> None:
         """ Delete a node and notify VBus. """
@@ -183,8 +274,13 @@ class Node(Element):
             LOGGER.warning('trying to remove unknown node: %s', uuid)
             return
 
+        # remote listeners must see the additions (of the element and of its children) before the removal
+        if uuid in self._pending.added.get(self._added_subject, ()):
+            await self._pending.flush(self._added_subject)
+        await self._pending.flush_under(join_path(self._path, uuid))
+
         data = {uuid: await definition.to_repr()}
-        await self._client.async_publish(join_path(self.path, NOTIF_REMOVED), data)
+        await self._client.async_publish(self._removed_subject, data)
 
 
 class Attribute(Element):
@@ -194,10 +290,14 @@ class Attribute(Element):
                  parent: Element = None):
         super().__init__(client, uuid, definition, parent)
         self._definition: definitions.AttributeDef = definition
+        self._set_subject = sys.intern(join_path(self._path, NOTIF_VALUE_SETTED))
 
     async def set_value(self, value: any):
         self._definition.value = value
-        await self._client.async_publish(join_path(self.path, NOTIF_VALUE_SETTED), value)
+        if self._pending.added:
+            # a buffered addition holds the previous value, remote listeners must know the attribute first
+            await self._pending.flush_covering(self._path)
+        await self._client.async_publish(self._set_subject, value)
 
 
 class Method(Element):
@@ -207,14 +307,17 @@ class Method(Element):
                  parent: Element = None):
         super().__init__(client, uuid, definition, parent)
         self._definition = definition
+        self._call_subject = sys.intern(join_path(self._path, NOTIF_SETTED))
 
     async def call(self, *args: any, timeout_sec: float = DEFAULT_TIMEOUT):
         """ Make a remote procedure call.
         """
-        return await self._client.async_request(join_path(self.path, NOTIF_SETTED), tuple(args), timeout=timeout_sec)
+        return await self._client.async_request(self._call_subject, args, timeout=timeout_sec)
 
 
 class ModuleStatus:
+    __slots__ = ('heap_size',)
+
     def __init__(self, heap_size: int):
         self.heap_size = heap_size
 
@@ -229,6 +332,8 @@ class ModuleStatus:
 
 
 class ModuleInfo:
+    __slots__ = ('id', 'hostname', 'client', 'has_static_files', 'status')
+
     def __init__(self, _id, hostname, client: str, has_static_files: bool, status: ModuleStatus):
         self.id = _id
         self.hostname = hostname
@@ -273,11 +378,41 @@ class NodeManager(Node):
         super().__init__(nats, "", definitions.NodeDef({}))
         self._nats = nats
         self._static_path = static_path
+        self._index_path = os.path.join(static_path, "index.html") if static_path is not None else None
         self._password = password
+        self._process = None  # psutil process, created on the first info request
+        self._module_info: Optional[ModuleInfo] = None
+        self._path_index: Dict[str, Definition] = {}  # path -> static definition, see _search_path
+        self._path_index_version = -1
+        self._nodes_response = (None, None)  # (tree representation, _on_get_nodes response encoded in json)
+        self._pruned_responses = (None, {})  # (tree representation, pruned responses encoded in json by max_level)
+        self._remote_root: Optional['proxies.NodeProxy'] = None  # stateless, shared by get_remote_* lookups
+        # segments -> (expiry, method definition), least recently used first
+        self._remote_methods: OrderedDict = OrderedDict()
+        self._path_handlers = {NOTIF_GET: "handle_get", NOTIF_SETTED: "handle_set"}  # definition method by last path segment
+        self._path_not_found = None  # constant, encoded in json on first use
+
+    def batch_updates(self) -> _PendingUpdates:
+        """ Buffer the notifications of added elements and send them when the block exits,
+            one message per parent node (useful when building the initial tree).
+
+            >>> async with client.batch_updates():
+            >>>     for uuid, raw_node in devices.items():
+            >>>         await client.add_node(uuid, raw_node)
+
+            Removals and value updates are still sent immediately, buffered additions of a removed element
+            (or of its children) are sent just before its removal, and the buffered addition of an attribute
+            (or of its ancestors) is sent just before its value update.
+            Batching applies to the whole tree: while a block is active, additions made by other tasks
+            are buffered too and sent when the outermost block exits.
+        """
+        return self._pending
 
     async def initialize(self):
         await self._nats.async_subscribe("", cb=self._on_get_nodes, with_host=False)
-        await self._nats.async_subscribe(">", cb=self._on_get_path)
+        # every get, set and method call goes through this subscription: a slow user method (e.g. a long scan)
+        # must not delay the others, so callbacks are not limited
+        await self._nats.async_subscribe(">", cb=self._on_get_path, max_workers=None)
         await self._nats.async_subscribe("info", cb=self._on_get_module_info, with_id=False, with_host=False)
 
         # handle static file server
@@ -287,16 +422,25 @@ class NodeManager(Node):
     async def _static_file_method(self, method: str, uri: str, **kwargs) -> str:
         """ A vBus method to serve static files through vBus. """
         LOGGER.debug("static: received %s on %s", method, uri)
+        # disk access is blocking, run it in a thread
+        return await self._nats.loop.run_in_executor(None, self._read_static_file, uri)
 
+    def _read_static_file(self, uri: str) -> str:
+        """ Read a static file and encode it in base64. """
         file_path = os.path.join(self._static_path, uri)
-        if not os.path.exists(file_path):
-            file_path = os.path.join(self._static_path, "index.html")  # assume SPA
-
-        with open(file_path, 'rb') as f:
-            content = base64.b64encode(f.read()).decode()
-            return content
-
-    async def discover(self, domain: str, app_name: str, timeout: int = 1, level: int = None) -> proxies.UnknownProxy:
+        try:
+            st = os.stat(file_path)
+            if stat.S_ISDIR(st.st_mode):
+                raise IsADirectoryError(file_path)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            file_path = self._index_path  # assume SPA
+            st = os.stat(file_path)
+        # the modification time is part of the cache key, so an updated file is read again
+        return _encode_static_file(file_path, st.st_mtime_ns)
+
+    async def discover(self, domain: str, app_name: str, timeout: int = 1, level: int = None,
+                       quiet_period: float = None, min_responders: int = None,
+                       max_responders: int = None) -> 'proxies.UnknownProxy':
         """ Discover a remote bus tree (A Vbus tree is composed of Vbus elements).
 
             >>> async def traverse_node(node: NodeProxy, level: int):
@@ -319,111 +463,189 @@ class NodeManager(Node):
             :param app_name: Remote app name
             :param timeout: Timeout in sec
             :param level: (not yet supported)
+            :param quiet_period: Return early when no response arrived for this time (in sec) after the first one
+            :param min_responders: Return as soon as this number of responses is received
+            :param max_responders: Responses received beyond this number are ignored (no limit by default)
             :return: An unknown proxy
         """
-        json_node = {}
-
-        async def async_on_discover(msg):
-            nonlocal json_node
-            json_data = from_vbus(msg.data)
-            json_node = {**json_node, **json_data}
-
         filters = {}
         if level:
             filters["max_level"] = level
 
-        sid = await self._nats.nats.request(f"{domain}.{app_name}",
-                                            to_vbus(filters),
-                                            expected=99999,
-                                            # a big number to wait until timeout, sys.maxsize seems to break nats sometime
-                                            cb=async_on_discover)
-        await asyncio.sleep(timeout)
-        await self._nats.nats.unsubscribe(sid)
+        trees = await self._async_collect_responses(f"{domain}.{app_name}", to_vbus(filters), lambda tree: tree,
+                                                    timeout, quiet_period, min_responders, max_responders)
+
+        # merge responses once, instead of copying the whole tree for every response
+        json_node = {}
+        for tree in trees:
+            json_node.update(tree)
+        from . import proxies
         return proxies.UnknownProxy(self._nats, f"{domain}.{app_name}", json_node)
 
-    async def discover_modules(self, timeout: int = 1) -> List[ModuleInfo]:
+    async def discover_modules(self, timeout: int = 1, quiet_period: float = None,
+                               min_responders: int = None, max_responders: int = None) -> List[ModuleInfo]:
         """ Discover running vBus modules.
+
+            :param timeout: Timeout in sec
+            :param quiet_period: Return early when no response arrived for this time (in sec) after the first one
+            :param min_responders: Return as soon as this number of modules answered
+            :param max_responders: Modules answering beyond this number are ignored (no limit by default)
+        """
+        return await self._async_collect_responses("info", b"", ModuleInfo.from_repr, timeout, quiet_period,
+                                                   min_responders, max_responders)
+
+    async def _async_collect_responses(self, subject: str, data: bytes, parse: Callable[[Dict], any],
+                                       timeout: float, quiet_period: Optional[float], min_responders: int = None,
+                                       max_responders: int = None) -> List:
+        """ Publish a request and collect the parsed responses of all responders until timeout.
+            Invalid responses are logged and skipped, they are not counted as responders.
         """
-        resp: List[ModuleInfo] = []
-
-        async def async_on_discover(msg):
-            nonlocal resp
-            json_data = from_vbus(msg.data)
-            info = ModuleInfo.from_repr(json_data)
-            resp.append(info)
-
-        sid = await self._nats.nats.request(f"info",
-                                            b"",
-                                            expected=sys.maxsize,
-                                            cb=async_on_discover)
-        await asyncio.sleep(timeout)
-        await self._nats.nats.unsubscribe(sid)
-        return resp
+        responses = []
+        received = asyncio.Event()
+        limits = [n for n in (min_responders, max_responders) if n]
+        limit = min(limits) if limits else None
+
+        async def on_response(msg):
+            if max_responders and len(responses) >= max_responders:
+                return
+            try:
+                value = from_vbus(msg.data)
+                if not isinstance(value, dict):
+                    raise ValueError(f"expected a json object, got {type(value).__name__}")
+                responses.append(parse(value))
+            except Exception as e:
+                LOGGER.warning('ignoring invalid response: %r', e)
+                return
+            received.set()
+
+        # a plain subscription on our own inbox: the number of responders is unknown
+        inbox = f"_INBOX.{uuid4().hex}"
+        sid = await self._nats.nats.subscribe(inbox, cb=on_response)
+        try:
+            await self._nats.nats.publish_request(subject, inbox, data)
+            enough = (lambda: len(responses) >= limit) if limit else None
+            await self._wait_responses(received, timeout, quiet_period, enough)
+        finally:
+            await self._nats.nats.unsubscribe(sid)
+        return responses
+
+    @staticmethod
+    async def _wait_responses(received: asyncio.Event, timeout: float, quiet_period: Optional[float],
+                              enough: Callable[[], bool] = None):
+        """ Wait for responses during timeout.
+            With a quiet period, stop as soon as no response arrived for quiet_period after the first one.
+            Stop as soon as enough() returns True.
+        """
+        if quiet_period is None and enough is None:
+            await asyncio.sleep(timeout)
+            return
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        responded = False
+        while enough is None or not enough():
+            if received.is_set():  # responses arrived since the last check
+                received.clear()
+                responded = True
+            remaining = deadline - loop.time()
+            if responded and quiet_period is not None:
+                remaining = min(quiet_period, remaining)
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(received.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
 
     async def _on_get_nodes(self, data):
         """ Get all nodes. """
         if data and isinstance(data, dict) and "max_level" in data:
             level = data["max_level"]
-            data = {self._nats.hostname: await self._definition.to_repr()}
-            prune_dict(data, level)
-            return data
+            tree = await self._definition.to_repr()
+            if self._pruned_responses[0] is not tree:
+                self._pruned_responses = (tree, {})
+            # max_level comes from the network, only well-formed levels are cached
+            cacheable = type(level) is int
+            responses = self._pruned_responses[1]
+            response = responses.get(level) if cacheable else None
+            if response is None:
+                # representations may be shared (e.g. methods), so prune a copy
+                data = {self._nats.hostname: copy.deepcopy(tree)}
+                prune_dict(data, level)
+                response = EncodedJson(to_vbus(data))
+                if cacheable and len(responses) < PRUNED_RESPONSES_MAX_LEVELS:
+                    responses[level] = response
+            return response
         else:
-            return {
-                self._nats.hostname: await self._definition.to_repr()
-            }
-
-    async def _handle_set(self, parts: List[str], data) -> Node:
-        node_builder = await self._definition.search_path(parts)
-        if node_builder:
-            try:
-                return await node_builder.handle_set(data, parts)
-            except Exception as e:
-                LOGGER.exception(e)
-                return await definitions.ErrorDefinition.InternalError(e).to_repr()
-        else:
-            return await definitions.ErrorDefinition.PathNotFoundError().to_repr()
-
-    async def _handle_get(self, parts: List[str], data) -> Node:
-        node_builder = await self._definition.search_path(parts)
+            # the tree representation is cached until the tree changes, so is the encoded response
+            tree = await self._definition.to_repr()
+            if self._nodes_response[0] is not tree:
+                self._nodes_response = (tree, EncodedJson(to_vbus({self._nats.hostname: tree})))
+            return self._nodes_response[1]
+
+    async def _handle(self, node_builder: Optional[Definition], parts: List[str], data, verb: str):
+        """ Call the verb handler (handle_get or handle_set) of the definition found at this path. """
         if node_builder:
             try:
-                return await node_builder.handle_get(data, parts)
+                return await getattr(node_builder, verb)(data, parts)
             except Exception as e:
                 LOGGER.exception(e)
                 return await definitions.ErrorDefinition.InternalError(e).to_repr()
         else:
-            return await definitions.ErrorDefinition.PathNotFoundError().to_repr()
+            if self._path_not_found is None:
+                self._path_not_found = EncodedJson(
+                    to_vbus(await definitions.ErrorDefinition.PathNotFoundError().to_repr()))
+            return self._path_not_found
 
     async def _on_get_path(self, data, path: str):
         """ Get a specific path in a node. """
-        parts = path.split('.')
-        if len(parts) < 1:
-            return
+        prefix, _, method = path.rpartition('.')
+        verb = self._path_handlers.get(method)
+        if verb is None:
+            return None
+        parts = prefix.split('.') if prefix else []
+        return await self._handle(await self._search_path(prefix, parts), parts, data, verb)
 
-        method = parts.pop()
-        if method == NOTIF_GET:
-            return await self._handle_get(parts, data)
-        elif method == NOTIF_SETTED:
-            return await self._handle_set(parts, data)
-        return None
+    async def _search_path(self, path: str, parts: List[str]) -> Optional[Definition]:
+        """ Search a local definition.
+            Definitions reached through static nodes only are cached by path until elements are added or removed,
+            dynamic ones (e.g. AsyncNodeDef) are searched every time.
+        """
+        if self._path_index_version != definitions.structure_version():
+            self._path_index.clear()
+            self._path_index_version = definitions.structure_version()
+
+        definition = self._path_index.get(path)
+        if definition is None:
+            definition = self._definition.find_static_path(parts)
+            if definition is not None:
+                self._path_index[path] = definition
+            else:
+                definition = await self._definition.search_path(parts)
+        return definition
 
     async def _on_get_module_info(self, data):
-        from psutil import Process
-        from os import getpid
+        if self._module_info is None:
+            # only the heap size changes, the process handle and the module info are created once
+            self._process = _PsProcess(os.getpid()) if _PsProcess else None
+            self._module_info = ModuleInfo(
+                _id=self._nats.id,
+                hostname=self._nats.hostname,
+                client="python",
+                has_static_files=self._static_path is not None,
+                status=ModuleStatus(heap_size=0)
+            )
 
-        process = Process(getpid())
+        self._module_info.status.heap_size = self._process.memory_info().rss if self._process else 0
+        return self._module_info.to_repr()
 
-        return ModuleInfo(
-            _id=self._nats.id,
-            hostname=self._nats.hostname,
-            client="python",
-            has_static_files=self._static_path is not None,
-            status=ModuleStatus(
-                heap_size=process.memory_info().rss
-            )
-        ).to_repr()
+    def _get_remote_root(self) -> 'proxies.NodeProxy':
+        if self._remote_root is None:
+            from . import proxies
+            self._remote_root = proxies.NodeProxy(self._nats, "", {})
+        return self._remote_root
 
-    async def get_remote_node(self, *segments: str, timeout: float = DEFAULT_TIMEOUT) -> proxies.NodeProxy:
+    async def get_remote_node(self, *segments: str, timeout: float = DEFAULT_TIMEOUT) -> 'proxies.NodeProxy':
         """ Retrieve a remote node proxy.
 
             >>> remote_node = await client.get_remote_node("system", "zigbee", "host", "path", "to", "node")
@@ -432,9 +654,9 @@ class NodeManager(Node):
             :param segments: path segments
             :param timeout: timeout in seconds (optional)
         """
-        return await proxies.NodeProxy(self._nats, "", {}).get_node(*segments, timeout=timeout)
+        return await self._get_remote_root().get_node(*segments, timeout=timeout)
 
-    async def get_remote_method(self, *segments: str, timeout: float = DEFAULT_TIMEOUT) -> proxies.MethodProxy:
+    async def get_remote_method(self, *segments: str, timeout: float = DEFAULT_TIMEOUT) -> 'proxies.MethodProxy':
         """ Retrieve a remote method proxy.
 
             >>> remote_method = await client.get_remote_method("system", "zigbee", "host", "path", "to", "method")
@@ -443,9 +665,22 @@ class NodeManager(Node):
             :param segments: path segments
             :param timeout: timeout in seconds (optional)
         """
-        return await proxies.NodeProxy(self._nats, "", {}).get_method(*segments, timeout=timeout)
-
-    async def get_remote_attr(self, *segments: str, timeout: float = DEFAULT_TIMEOUT) -> proxies.AttributeProxy:
+        # method schemas rarely change, the definition is reused for a while to skip the round-trip
+        now = time.monotonic()
+        cached = self._remote_methods.get(segments)
+        if cached and cached[0] > now:
+            self._remote_methods.move_to_end(segments)
+            from . import proxies
+            return proxies.MethodProxy(self._nats, join_path(*segments), cached[1])
+
+        method = await self._get_remote_root().get_method(*segments, timeout=timeout)
+        if Definition.is_method(method.definition):  # do not keep errors
+            self._remote_methods[segments] = (now + REMOTE_METHOD_CACHE_TTL, method.definition)
+            if len(self._remote_methods) > REMOTE_METHOD_CACHE_SIZE:
+                self._remote_methods.popitem(last=False)
+        return method
+
+    async def get_remote_attr(self, *segments: str, timeout: float = DEFAULT_TIMEOUT) -> 'proxies.AttributeProxy':
         """ Retrieve a remote attribute proxy.
 
             >>> remote_attr = await client.get_remote_attr("system", "zigbee", "host", "path", "to", "attr")
@@ -454,10 +689,10 @@ class NodeManager(Node):
             :param segments: path segments
             :param timeout: timeout in seconds (optional)
         """
-        return await proxies.NodeProxy(self._nats, "", {}).get_attribute(*segments, timeout=timeout)
+        return await self._get_remote_root().get_attribute(*segments, timeout=timeout)
 
     async def expose(self, name: str, protocol: str, port: int, path: str = ''):
-        config = self._client.read_or_get_default_config()
+        config = await self._client.async_read_or_get_default_config()
         network_ip = config["vbus"]["networkIp"]
 
         if not network_ip:
@@ -369,6 +369,14 @@ class MethodProxy(Proxy):
         super().__init__(nats, path)
         self._node_def = node_def
 
+    @property
+    def definition(self) -> Dict:
+        """ Retrieve the raw method definition (params and returns schemas).
+
+            :getter: Returns the definition.
+        """
+        return self._node_def
+
     @property
     def params_schema(self) -> Dict:
         """ Retrieve params Json-schema.
@@ -411,7 +419,7 @@ class MethodProxy(Proxy):
             :param args: The required params as described by the Json-schema
             :param timeout_sec: The timeout in sec
         """
-        return await self._nats.async_request(self._path + ".set", tuple(args),
+        return await self._nats.async_request(self._path + ".set", args,
                                               with_host=with_host,
                                               with_id=with_id,
                                               timeout=timeout_sec)
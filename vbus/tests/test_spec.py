@@ -4,6 +4,8 @@ import unittest
 import vbus
 import logging
 
+from vbus.definitions import A, M
+from vbus.nats import ExtendedNatsClient
 from vbus.proxies import NodeProxy
 from vbus.tests.utils import async_test, setup_test, retry
 
@@ -94,6 +96,139 @@ class TestStringMethods(unittest.TestCase):
 
         self.assert_player_success(player)
 
+    @async_test
+    async def test_add_children(self):
+        player = setup_test("./scenarios/add_children.json")
+        client = await self.new_client()
+
+        async def echo(msg: str, **kwargs) -> str:
+            return msg
+
+        elements = await client.add_children({
+            "00:45:25:65:25:ff": {"name": A("name", "HEIMAN")},
+            "echo": M(echo),
+            "temp": 21,
+        })
+        self.assertEqual(["00:45:25:65:25:ff", "echo", "temp"], list(elements))
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_slow_method_does_not_block_get(self):
+        player = setup_test("./scenarios/slow_method_get_attribute.json")
+        client = await self.new_client()
+
+        async def scan(**kwargs) -> None:
+            await asyncio.sleep(5)
+
+        # the scenario calls scan more times than SUBSCRIPTION_MAX_WORKERS, then gets name within the request timeout
+        await client.add_method("scan", scan)
+        await client.add_attribute("name", "HEIMAN")
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_subscribe_max_workers(self):
+        player = setup_test("./scenarios/subscribe_max_workers.json")
+        nats = ExtendedNatsClient("test", "vbuspy")
+        await nats.async_connect()
+
+        running = 0
+        peak = 0
+        received = 0
+        done = asyncio.Event()
+
+        async def on_data(data, *args):
+            nonlocal running, peak, received
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.1)
+            running -= 1
+            received += 1
+            if received == 10:  # the scenario publishes 10 messages at once
+                done.set()
+
+        await nats.async_subscribe("data", cb=on_data, max_workers=2)
+        await asyncio.wait_for(done.wait(), 5)
+        self.assertEqual(2, peak)
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_batch_updates(self):
+        player = setup_test("./scenarios/batch_updates.json")
+        client = await self.new_client()
+
+        async with client.batch_updates():
+            node = await client.add_node("00:45:25:65:25:ff", {})
+            attr = await node.add_attribute("name", "HEIMAN")
+            self.assertIsNotNone(attr)
+            await client.add_attribute("temp", 21)
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_batch_updates_set_value(self):
+        player = setup_test("./scenarios/batch_updates_set_value.json")
+        client = await self.new_client()
+
+        async with client.batch_updates():
+            attr = await client.add_attribute("temp", 21)
+            await attr.set_value(22)  # the buffered addition is published first
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_batch_updates_remove_element(self):
+        player = setup_test("./scenarios/batch_updates_remove_element.json")
+        client = await self.new_client()
+
+        async with client.batch_updates():
+            node = await client.add_node("00:45:25:65:25:ff", {})
+            await node.add_attribute("name", "HEIMAN")
+            await client.remove_element("00:45:25:65:25:ff")  # the buffered additions are published first
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_discover_modules_quiet_period(self):
+        player = setup_test("./scenarios/discover_modules.json")
+        client = await self.new_client()
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        modules = await client.discover_modules(timeout=5, quiet_period=0.5)
+        self.assertLess(loop.time() - start, 5)  # the scenario modules answer at once, then go quiet
+        self.assertEqual(3, len(modules))
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_discover_modules_min_responders(self):
+        player = setup_test("./scenarios/discover_modules.json")
+        client = await self.new_client()
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        modules = await client.discover_modules(timeout=5, min_responders=2)
+        self.assertLess(loop.time() - start, 5)
+        self.assertGreaterEqual(len(modules), 2)
+
+        self.assert_player_success(player)
+
+    @async_test
+    async def test_discover_modules_max_responders(self):
+        player = setup_test("./scenarios/discover_modules.json")
+        client = await self.new_client()
+
+        modules = await client.discover_modules(timeout=1, max_responders=2)
+        self.assertEqual(2, len(modules))
+
+        modules = await client.discover_modules(timeout=1)  # no limit by default
+        self.assertEqual(3, len(modules))
+
+        self.assert_player_success(player)
+
     @staticmethod
     @retry(Exception, tries=4)
     async def new_client():